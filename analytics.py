@@ -0,0 +1,156 @@
+import json
+import re
+from datetime import datetime, timedelta
+
+from database import connect_years, get_connection
+
+PERIODOS = {
+    "dia": re.compile(r"\d{4}-\d{2}-\d{2}"),
+    "mes": re.compile(r"\d{4}-\d{2}"),
+    "anio": re.compile(r"\d{4}"),
+}
+
+DIAS_SEMANA = ["Domingo", "Lunes", "Martes", "Miercoles", "Jueves", "Viernes", "Sabado"]
+
+TOP_PAGADORES = 10
+
+# Nombres de relleno cuando MP no trae el pagador real (no cuentan como pagadores)
+NOMBRES_GENERICOS = ("Cliente", "Desconocido", "Transferencia Recibida")
+
+
+def valid_period(periodo, valor):
+    pattern = PERIODOS.get(periodo)
+    if not (pattern and valor and pattern.fullmatch(valor)):
+        return False
+    try:
+        _period_end(periodo, valor)
+    except ValueError:
+        return False
+    return True
+
+
+def _period_end(periodo, valor):
+    """Primer instante posterior al periodo (para saber si ya esta cerrado)."""
+    if periodo == "dia":
+        return datetime.strptime(valor, "%Y-%m-%d") + timedelta(days=1)
+    if periodo == "mes":
+        inicio = datetime.strptime(valor, "%Y-%m")
+        return (inicio + timedelta(days=32)).replace(day=1)
+    return datetime(int(valor) + 1, 1, 1)
+
+
+def _is_closed(periodo, valor):
+    # Un dia de margen: pagos de ultimo momento que llegan por webhook o polling despues de medianoche
+    return _period_end(periodo, valor) + timedelta(days=1) <= datetime.now()
+
+
+def _compute(periodo, valor, top):
+    conn, source = connect_years([valor[:4]])
+    # date_created es ISO (YYYY-MM-DDTHH:MM:SS...): el prefijo del periodo define un rango indexable.
+    # "~" ordena despues de cualquier caracter de una fecha ISO.
+    rango = "date_created >= ? AND date_created < ?"
+    params = [valor, valor + "~"]
+    try:
+        # Una sola pasada para hora, dia de semana, tipo, banco y estado; se acumula en Python
+        rows = conn.execute(f"""
+            SELECT
+                substr(date_created, 12, 2) AS hora,
+                CAST(strftime('%w', substr(date_created, 1, 10)) AS INTEGER) AS dia_semana,
+                COALESCE(NULLIF(payment_type, ''), 'Sin dato') AS tipo,
+                COALESCE(NULLIF(bank, ''), 'Sin dato') AS banco,
+                status,
+                COUNT(*) AS cantidad,
+                COALESCE(SUM(amount), 0) AS total
+            FROM {source}
+            WHERE {rango}
+            GROUP BY hora, dia_semana, tipo, banco, status
+        """, params).fetchall()
+
+        top_rows = {}
+        for campo, excluidos in (("payer_name", NOMBRES_GENERICOS), ("payer_email", ())):
+            excluir = f" AND {campo} NOT IN ({', '.join('?' * len(excluidos))})" if excluidos else ""
+            top_rows[campo] = conn.execute(f"""
+                SELECT {campo} AS pagador, COUNT(*) AS cantidad, SUM(amount) AS total
+                FROM {source}
+                WHERE {rango} AND status = 'approved' AND COALESCE({campo}, '') != ''{excluir}
+                GROUP BY {campo}
+                ORDER BY total DESC
+                LIMIT ?
+            """, params + list(excluidos) + [top]).fetchall()
+    finally:
+        conn.close()
+
+    por_hora = {f"{h:02d}": {"hora": f"{h:02d}", "cantidad": 0, "total": 0} for h in range(24)}
+    por_dia = [{"dia": nombre, "cantidad": 0, "total": 0} for nombre in DIAS_SEMANA]
+    por_tipo = {}
+    por_banco = {}
+    estados = {}
+
+    for row in rows:
+        estado = estados.setdefault(row["status"] or "Sin dato", {"cantidad": 0, "total": 0})
+        estado["cantidad"] += row["cantidad"]
+        estado["total"] += row["total"]
+
+        # El resto de los desgloses son de ventas (solo aprobados)
+        if row["status"] != "approved":
+            continue
+        grupos = [por_tipo.setdefault(row["tipo"], {"tipo": row["tipo"], "cantidad": 0, "total": 0}),
+                  por_banco.setdefault(row["banco"], {"banco": row["banco"], "cantidad": 0, "total": 0})]
+        if row["hora"] in por_hora:
+            grupos.append(por_hora[row["hora"]])
+        if row["dia_semana"] is not None:
+            grupos.append(por_dia[row["dia_semana"]])
+        for grupo in grupos:
+            grupo["cantidad"] += row["cantidad"]
+            grupo["total"] += row["total"]
+
+    aprobados = estados.get("approved", {}).get("cantidad", 0)
+    rechazados = estados.get("rejected", {}).get("cantidad", 0)
+    decididos = aprobados + rechazados
+
+    return {
+        "periodo": periodo,
+        "valor": valor,
+        "por_hora": list(por_hora.values()),
+        "por_dia_semana": por_dia,
+        "por_tipo": sorted(por_tipo.values(), key=lambda g: g["total"], reverse=True),
+        "por_banco": sorted(por_banco.values(), key=lambda g: g["total"], reverse=True),
+        "top_nombres": [dict(r) for r in top_rows["payer_name"]],
+        "top_emails": [dict(r) for r in top_rows["payer_email"]],
+        "estados": estados,
+        "tasa_aprobacion": aprobados / decididos if decididos else None,
+        "tasa_rechazo": rechazados / decididos if decididos else None,
+    }
+
+
+def get_statistics(periodo, valor, top=TOP_PAGADORES):
+    """Estadisticas de un periodo (dia/mes/anio) calculadas en SQLite.
+
+    Los periodos cerrados se guardan en stats_cache; insert_payments_bulk borra
+    la entrada si llega un pago nuevo para ese periodo (por ejemplo, un backfill).
+    """
+    closed = _is_closed(periodo, valor) and top == TOP_PAGADORES
+    if closed:
+        conn = get_connection()
+        try:
+            row = conn.execute(
+                "SELECT data FROM stats_cache WHERE periodo = ? AND valor = ?", (periodo, valor)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row:
+            return json.loads(row["data"])
+
+    stats = _compute(periodo, valor, top)
+
+    if closed:
+        conn = get_connection()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO stats_cache (periodo, valor, data) VALUES (?, ?, ?)",
+                (periodo, valor, json.dumps(stats)),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    return stats
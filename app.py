@@ -1,18 +1,30 @@
+import time
+
+# Perfil de arranque: se mide desde antes de importar Flask
+_START = time.perf_counter()
+
 from datetime import datetime, timezone
+import importlib
+import json
+from json.encoder import encode_basestring_ascii
 import random
 import re
 import threading
-import time
 
 from io import BytesIO
 
 from functools import wraps
 from flask import Flask, request, render_template, jsonify, send_file, session, redirect, url_for
-import requests
 
-from config import MP_ACCESS_TOKEN, FLASK_PORT, FLASK_SECRET_KEY, DASHBOARD_PASSWORD
-from database import init_db, insert_payment, get_payments, get_totals, get_payments_by_period
-from tts import announce_payment
+# requests, edge_tts y openpyxl se importan recien al usarse (y se precargan en
+# segundo plano con prewarm_modules) para que el servidor escuche enseguida.
+from config import MP_ACCESS_TOKEN, FLASK_PORT, FLASK_SECRET_KEY, DASHBOARD_PASSWORD, ACCOUNT_CACHE_PATH
+from database import (
+    init_db, insert_payment, insert_payments_bulk, get_payments, get_totals, get_payments_by_period, rollover_payments,
+    LIST_COLUMNS, EXPORT_COLUMNS,
+)
+from analytics import get_statistics, valid_period, TOP_PAGADORES
+from tts import announce_payment, prewarm_tts
 
 app = Flask(__name__)
 app.secret_key = FLASK_SECRET_KEY
@@ -26,14 +38,40 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated
 
-# Datos de nuestra cuenta MP (se obtienen al iniciar)
+
+def _json_value(value):
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return "null"
+    return repr(value)
+
+
+def jsonify_payments(payments, **extra):
+    """Como jsonify, pero la lista de pagos (registros Payment) se serializa
+    directo desde las tuplas, sin armar un dict por fila."""
+    rows = ""
+    if payments:
+        keys = [encode_basestring_ascii(field) + ":" for field in payments[0]._fields]
+        rows = ",".join("{" + ",".join(k + _json_value(v) for k, v in zip(keys, p)) + "}" for p in payments)
+    body = '{"payments":[' + rows + "]"
+    if extra:
+        body += "," + json.dumps(extra, separators=(",", ":"))[1:]
+    else:
+        body += "}"
+    return app.response_class(response=body, status=200, mimetype="application/json")
+
+# Datos de nuestra cuenta MP (se cargan del cache al iniciar y se actualizan en segundo plano)
 MY_USER_ID = None
 MY_USER_NAME = ""
 MY_USER_EMAIL = ""
+# Sin identidad no se pueden filtrar los pagos salientes: webhook y polling esperan este evento
+MY_USER_READY = threading.Event()
 
 
 def fetch_my_user_info():
     """Obtiene el user_id, nombre y email de nuestra cuenta MP."""
+    import requests
     headers = {"Authorization": f"Bearer {MP_ACCESS_TOKEN}"}
     try:
         response = requests.get("https://api.mercadopago.com/users/me", headers=headers, timeout=10)
@@ -51,17 +89,60 @@ def fetch_my_user_info():
     return None, "", ""
 
 
+def load_cached_user_info():
+    """Lee la identidad de la cuenta guardada en la ultima ejecucion."""
+    try:
+        with open(ACCOUNT_CACHE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get("id"), data.get("name", ""), data.get("email", "")
+    except (OSError, ValueError):
+        return None, "", ""
+
+
+def resolve_my_user_info():
+    """Hilo de inicio: identifica la cuenta en MP (reintenta cada 60s) y guarda una copia en disco."""
+    global MY_USER_ID, MY_USER_NAME, MY_USER_EMAIL
+    while True:
+        uid, full_name, email = fetch_my_user_info()
+        if uid:
+            break
+        print("[MP] No se pudo identificar la cuenta, se usa la copia guardada y se reintenta en 60s")
+        time.sleep(60)
+
+    MY_USER_ID, MY_USER_NAME, MY_USER_EMAIL = uid, full_name, email
+    MY_USER_READY.set()
+    try:
+        with open(ACCOUNT_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"id": uid, "name": full_name, "email": email}, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"[MP] No se pudo guardar la cuenta en cache: {e}")
+
+
+def prewarm_modules():
+    """Carga los modulos pesados fuera del camino de las requests e informa cuanto tardo cada uno."""
+    for name in ("requests", "openpyxl", "openpyxl.styles"):
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"[Inicio] No se pudo cargar {name}: {e}")
+            continue
+        print(f"[Inicio] {name} cargado en {(time.perf_counter() - t0) * 1000:.0f} ms")
+    # El worker de voz importa edge_tts al arrancar
+    prewarm_tts()
+
+
 # --- Polling: consulta la API de MP cada 15 segundos como respaldo del webhook ---
 
-def process_payment_info(payment_info):
-    """Procesa un pago obtenido de la API de MP (usado por webhook y polling)."""
+def build_payment_data(payment_info):
+    """Arma el registro a guardar a partir de un pago de la API de MP. None si es un pago saliente."""
     # Ignorar pagos salientes (transferencias que nosotros enviamos)
     operation_type = payment_info.get("operation_type", "")
     if operation_type in ("money_transfer", "account_fund"):
         # Verificar si es un pago saliente comparando collector con nuestra cuenta
         collector = payment_info.get("collector_id") or (payment_info.get("collector", {}) or {}).get("id")
         if MY_USER_ID and collector and str(collector) != str(MY_USER_ID):
-            return False
+            return None
 
     payer = payment_info.get("payer", {})
     payer_id = payer.get("id")
@@ -132,29 +213,54 @@ def process_payment_info(payment_info):
     }
     payment_type = type_map.get(payment_type_id, "Transferencia")
 
-    payment_data = {
+    # Banco o billetera de origen segun MP (transferencias): es el codigo que informa MP,
+    # no un nombre. Los pagos con saldo de cuenta MP no traen bank_info.
+    poi = payment_info.get("point_of_interaction") or {}
+    bank_info = (poi.get("transaction_data") or {}).get("bank_info") or {}
+    bank = str(bank_info.get("origin_bank_id") or bank_info.get("origin_wallet_id") or "")
+    if not bank and payment_type_id == "account_money":
+        bank = "Mercado Pago"
+
+    return {
         "mp_payment_id": payment_info.get("id"),
         "payer_name": payer_name,
         "payer_email": payer_email,
         "amount": payment_info.get("transaction_amount", 0),
+        "description": payment_info.get("description") or "",
         "status": payment_info.get("status", ""),
         "payment_type": payment_type,
+        "bank": bank,
         "date_created": payment_info.get("date_created", ""),
     }
 
-    inserted = insert_payment(payment_data)
 
-    if inserted and payment_data["status"] in ("approved", "rejected"):
+def announce_new_payment(payment_data):
+    """Anuncia por voz un pago recien registrado (solo aprobados y rechazados)."""
+    if payment_data["status"] in ("approved", "rejected"):
+        payer_name = payment_data["payer_name"]
         say_name = payer_name if payer_name not in ("Cliente", "Transferencia Recibida") else None
         announce_payment(say_name, payment_data["amount"], rejected=(payment_data["status"] == "rejected"))
 
+
+def process_payment_info(payment_info):
+    """Procesa un pago obtenido de la API de MP (usado por el webhook)."""
+    payment_data = build_payment_data(payment_info)
+    if not payment_data:
+        return False
+
+    inserted = insert_payment(payment_data)
+    if inserted:
+        announce_new_payment(payment_data)
+
     return inserted
 
 
 def poll_payments():
     """Hilo de conciliacion: consulta pagos recientes a la API de MP cada 60s como backup del webhook."""
+    import requests
     headers = {"Authorization": f"Bearer {MP_ACCESS_TOKEN}"}
     last_check = datetime.now(timezone.utc)
+    MY_USER_READY.wait()
 
     while True:
         try:
@@ -173,15 +279,23 @@ def poll_payments():
             )
             if response.status_code == 200:
                 results = response.json().get("results", [])
+                batch = []
                 for result in results:
-                    pid = result.get("id")
                     # Consultar detalles completos (misma ruta que el webhook)
-                    payment_info = fetch_payment_details(pid)
+                    payment_info = fetch_payment_details(result.get("id"))
                     if not payment_info:
                         continue
-                    inserted = process_payment_info(payment_info)
-                    if inserted:
-                        print(f"[Polling] Pago detectado - ID: {pid}")
+                    payment_data = build_payment_data(payment_info)
+                    if payment_data:
+                        batch.append(payment_data)
+                # Un solo commit para todo el lote; se anuncian solo los que eran nuevos
+                new_ids = set(insert_payments_bulk(batch))
+                for payment_data in batch:
+                    pid = str(payment_data["mp_payment_id"])
+                    if pid in new_ids:
+                        new_ids.discard(pid)
+                        print(f"[Polling] Pago detectado - ID: {payment_data['mp_payment_id']}")
+                        announce_new_payment(payment_data)
             elif response.status_code == 429:
                 print("[Polling] Rate limit, esperando 60s...")
                 time.sleep(60)
@@ -193,8 +307,22 @@ def poll_payments():
         time.sleep(60)
 
 
+def rollover_archive():
+    """Hilo de mantenimiento: una vez por dia mueve los años cerrados al archivo y compacta la base."""
+    while True:
+        try:
+            moved = rollover_payments()
+            if moved:
+                print(f"[Archivo] {moved} pagos movidos al archivo anual")
+        except Exception as e:
+            print(f"[Archivo] Error: {e}")
+
+        time.sleep(24 * 60 * 60)
+
+
 def _process_webhook_payment(payment_id):
     """Procesa un pago del webhook en hilo separado."""
+    MY_USER_READY.wait()
     payment_info = fetch_payment_details(payment_id)
     if payment_info:
         process_payment_info(payment_info)
@@ -233,6 +361,7 @@ def webhook():
 
 
 def fetch_payment_details(payment_id):
+    import requests
     url = f"https://api.mercadopago.com/v1/payments/{payment_id}"
     headers = {"Authorization": f"Bearer {MP_ACCESS_TOKEN}"}
     for attempt in range(3):
@@ -278,6 +407,7 @@ def index():
     date_to = request.args.get("fecha_hasta", "").strip()
     amount_min = request.args.get("monto_min", "").strip()
     amount_max = request.args.get("monto_max", "").strip()
+    search = request.args.get("buscar", "").strip()
     page = max(1, int(request.args.get("page", 1)))
 
     payments, total, total_pages = get_payments(
@@ -286,6 +416,8 @@ def index():
         amount_min=amount_min or None,
         amount_max=amount_max or None,
         page=page,
+        search=search or None,
+        columns=LIST_COLUMNS,
     )
 
     totals = get_totals()
@@ -302,6 +434,7 @@ def index():
             "fecha_hasta": date_to,
             "monto_min": amount_min,
             "monto_max": amount_max,
+            "buscar": search,
         },
     )
 
@@ -335,7 +468,6 @@ def test_payment():
 @login_required
 def debug_payment(payment_id):
     """Muestra el JSON crudo que devuelve la API de MP para un pago."""
-    import json
     payment_info = fetch_payment_details(payment_id)
     if not payment_info:
         return jsonify({"error": "No se pudo obtener el pago"}), 404
@@ -401,13 +533,31 @@ def api_pagos():
         amount_min=request.args.get("monto_min") or None,
         amount_max=request.args.get("monto_max") or None,
         page=page,
+        search=request.args.get("buscar") or None,
+        columns=LIST_COLUMNS,
     )
     totals = get_totals(
         dia=request.args.get("totals_dia") or None,
         mes=request.args.get("totals_mes") or None,
         anio=request.args.get("totals_anio") or None,
     )
-    return jsonify({"payments": payments, "totals": totals, "page": page, "total_pages": total_pages, "total": total})
+    return jsonify_payments(payments, totals=totals, page=page, total_pages=total_pages, total=total)
+
+
+@app.route("/api/estadisticas")
+@login_required
+def api_estadisticas():
+    periodo = request.args.get("periodo", "mes")
+    valor = request.args.get("valor", "")
+
+    if not valid_period(periodo, valor):
+        return "Parametros 'periodo' (dia/mes/anio) y 'valor' (AAAA-MM-DD / AAAA-MM / AAAA) invalidos", 400
+
+    try:
+        top = min(100, max(1, int(request.args.get("top", TOP_PAGADORES))))
+    except ValueError:
+        return "Parametro 'top' invalido (entero entre 1 y 100)", 400
+    return jsonify(get_statistics(periodo, valor, top=top))
 
 
 @app.route("/api/exportar")
@@ -422,7 +572,7 @@ def exportar_excel():
     if not valor:
         return "Falta el parametro 'valor'", 400
 
-    payments = get_payments_by_period(periodo, valor)
+    payments = get_payments_by_period(periodo, valor, columns=EXPORT_COLUMNS)
 
     # Mapeo de tipos para registros viejos
     type_map = {
@@ -476,14 +626,14 @@ def exportar_excel():
     # Datos
     total = 0
     for i, p in enumerate(payments, 4):
-        fecha = (p.get("date_created") or "-")[:19]
-        tipo = type_map.get(p.get("payment_type", ""), p.get("payment_type", "-"))
-        monto = p.get("amount", 0)
+        fecha = (p.date_created or "-")[:19]
+        tipo = type_map.get(p.payment_type, p.payment_type)
+        monto = p.amount
         total += monto
 
         ws.cell(row=i, column=1, value=fecha).border = border
-        ws.cell(row=i, column=2, value=p.get("payer_name", "")).border = border
-        ws.cell(row=i, column=3, value=p.get("payer_email", "")).border = border
+        ws.cell(row=i, column=2, value=p.payer_name).border = border
+        ws.cell(row=i, column=3, value=p.payer_email).border = border
         ws.cell(row=i, column=4, value=tipo).border = border
         cell_monto = ws.cell(row=i, column=5, value=monto)
         cell_monto.number_format = '#,##0.00'
@@ -529,13 +679,21 @@ PUBLIC_URL = "https://holagranja.miguelkraus.uk"
 
 if __name__ == "__main__":
     init_db()
-    MY_USER_ID, MY_USER_NAME, MY_USER_EMAIL = fetch_my_user_info()
+    # Arrancar con la cuenta de la ultima ejecucion y confirmarla contra MP en segundo plano
+    MY_USER_ID, MY_USER_NAME, MY_USER_EMAIL = load_cached_user_info()
+    if MY_USER_ID:
+        MY_USER_READY.set()
+    threading.Thread(target=resolve_my_user_info, daemon=True).start()
+    threading.Thread(target=prewarm_modules, daemon=True).start()
     # Iniciar polling en hilo de fondo
     poll_thread = threading.Thread(target=poll_payments, daemon=True)
     poll_thread.start()
-    # Abrir navegador en la URL publica
+    # Rollover anual y compactacion en segundo plano
+    threading.Thread(target=rollover_archive, daemon=True).start()
+    # Abrir navegador en la URL publica (sin demorar el arranque del servidor)
     import webbrowser
-    webbrowser.open(PUBLIC_URL)
+    threading.Thread(target=webbrowser.open, args=(PUBLIC_URL,), daemon=True).start()
+    print(f"[Inicio] Listo para recibir webhooks en {(time.perf_counter() - _START) * 1000:.0f} ms")
     print(f"Servidor iniciado en {PUBLIC_URL}")
     print("Webhook + Polling cada 60s activos. Esperando pagos...")
     app.run(host="0.0.0.0", port=FLASK_PORT, debug=False)
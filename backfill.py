@@ -0,0 +1,115 @@
+"""Importa el historial de pagos de Mercado Pago para un rango de fechas.
+
+Uso:
+    python backfill.py 2025-01-01 2025-12-31
+    python backfill.py 2025-01-01 2025-12-31 --status approved
+
+Usa los resultados de /v1/payments/search directamente (ya traen el pago
+completo) y guarda cada pagina con insert_payments_bulk en una sola
+transaccion. No anuncia por voz: es historial.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+import app
+from config import MP_ACCESS_TOKEN
+from database import init_db, insert_payments_bulk, rollover_payments
+
+SEARCH_URL = "https://api.mercadopago.com/v1/payments/search"
+PAGE_SIZE = 1000
+# MP no pagina mas alla de este offset: las ventanas mas grandes se parten a la mitad
+MAX_OFFSET = 10000
+
+
+def _search(headers, begin, end, offset, status=None):
+    params = {
+        "sort": "date_created",
+        "criteria": "asc",
+        "range": "date_created",
+        "begin_date": begin.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "end_date": end.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "limit": PAGE_SIZE,
+        "offset": offset,
+    }
+    if status:
+        params["status"] = status
+    for attempt in range(3):
+        try:
+            response = requests.get(SEARCH_URL, headers=headers, params=params, timeout=30)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code == 429 or response.status_code >= 500:
+                print(f"[Backfill] Error {response.status_code} (intento {attempt + 1}/3)")
+                time.sleep(5)
+                continue
+            raise RuntimeError(f"Error {response.status_code}: {response.text}")
+        except requests.RequestException as e:
+            print(f"[Backfill] Intento {attempt + 1}/3 fallo: {e}")
+            time.sleep(5)
+    raise RuntimeError("La API de Mercado Pago no respondio")
+
+
+def backfill_window(headers, begin, end, status=None):
+    """Importa una ventana de tiempo. Devuelve (leidos, nuevos)."""
+    data = _search(headers, begin, end, 0, status)
+    total = data.get("paging", {}).get("total", 0)
+    if total > MAX_OFFSET and end - begin > timedelta(minutes=1):
+        middle = begin + (end - begin) / 2
+        left = backfill_window(headers, begin, middle, status)
+        # Las ventanas se solapan en middle a proposito: insert_payments_bulk descarta repetidos
+        right = backfill_window(headers, middle, end, status)
+        return left[0] + right[0], left[1] + right[1]
+
+    read = new = 0
+    offset = 0
+    while True:
+        results = data.get("results", [])
+        if not results:
+            break
+        batch = [p for p in (app.build_payment_data(r) for r in results) if p]
+        new += len(insert_payments_bulk(batch))
+        read += len(results)
+        # MP puede devolver menos que PAGE_SIZE por pagina: avanzar con lo que efectivamente vino
+        offset += len(results)
+        if offset >= total:
+            break
+        data = _search(headers, begin, end, offset, status)
+    return read, new
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa historial de pagos de Mercado Pago a la base local.")
+    parser.add_argument("desde", help="Fecha inicial YYYY-MM-DD")
+    parser.add_argument("hasta", help="Fecha final YYYY-MM-DD (inclusive)")
+    parser.add_argument("--status", help="Filtrar por estado (approved, rejected, ...)")
+    args = parser.parse_args()
+
+    # Fechas en hora local del servidor; se mandan a MP convertidas a UTC
+    begin = datetime.strptime(args.desde, "%Y-%m-%d").astimezone()
+    end = (datetime.strptime(args.hasta, "%Y-%m-%d") + timedelta(hours=23, minutes=59, seconds=59)).astimezone()
+
+    init_db()
+    app.MY_USER_ID, app.MY_USER_NAME, app.MY_USER_EMAIL = app.fetch_my_user_info()
+    if not app.MY_USER_ID:
+        app.MY_USER_ID, app.MY_USER_NAME, app.MY_USER_EMAIL = app.load_cached_user_info()
+    if not app.MY_USER_ID:
+        # Sin la cuenta no se pueden descartar las transferencias salientes: se guardarian como ingresos
+        raise SystemExit("[Backfill] No se pudo identificar la cuenta de Mercado Pago (ni hay copia en cuenta_mp.json)")
+
+    headers = {"Authorization": f"Bearer {MP_ACCESS_TOKEN}"}
+    start = time.perf_counter()
+    read, new = backfill_window(headers, begin, end, args.status)
+    elapsed = time.perf_counter() - start
+    print(f"[Backfill] {read} pagos leidos, {new} nuevos en {elapsed:.1f}s")
+
+    # Los pagos de años cerrados van directo a su archivo anual
+    moved = rollover_payments()
+    if moved:
+        print(f"[Backfill] {moved} pagos movidos al archivo anual")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,3 +8,5 @@ FLASK_PORT = int(os.getenv("FLASK_PORT", 5000))
 FLASK_SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "")
 DASHBOARD_PASSWORD = os.getenv("DASHBOARD_PASSWORD", "")
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), "payments.db")
+ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), "archivo")
+ACCOUNT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "cuenta_mp.json")
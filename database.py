@@ -1,17 +1,27 @@
+import heapq
+import os
+import re
 import sqlite3
-from config import DATABASE_PATH
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
 
+from config import DATABASE_PATH, ARCHIVE_DIR
 
-def get_connection():
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Orden explicito de columnas: las bases viejas agregaron payment_type y bank
+# con ALTER TABLE, asi que SELECT * no devuelve el mismo orden en todas.
+COLUMNS = (
+    "id", "mp_payment_id", "payer_name", "payer_email", "amount", "description",
+    "status", "payment_type", "bank", "date_created", "date_registered",
+)
 
+# Proyecciones por endpoint: cada vista trae solo las columnas que muestra
+LIST_COLUMNS = ("date_created", "payer_name", "amount", "payment_type", "status")
+EXPORT_COLUMNS = ("date_created", "payer_name", "payer_email", "payment_type", "amount")
 
-def init_db():
-    conn = get_connection()
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS payments (
+PAYMENTS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS {schema}.payments (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             mp_payment_id TEXT UNIQUE,
             payer_name TEXT,
@@ -24,46 +34,276 @@ def init_db():
             date_created TEXT,
             date_registered DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    """)
+"""
+
+# Las consultas por rango (estadisticas) filtran con date_created >= ? AND date_created < ?
+PAYMENTS_INDEX = "CREATE INDEX IF NOT EXISTS {schema}.idx_payments_date_created ON payments (date_created)"
+
+# Busqueda de pagadores: FTS5 sin acentos y con indice de prefijos, sincronizado por triggers
+SEARCH_SCHEMA = [
+    """
+        CREATE VIRTUAL TABLE IF NOT EXISTS {schema}.payments_fts USING fts5(
+            payer_name, payer_email, description, mp_payment_id,
+            content='payments', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS {schema}.payments_fts_ai AFTER INSERT ON payments BEGIN
+            INSERT INTO payments_fts (rowid, payer_name, payer_email, description, mp_payment_id)
+            VALUES (new.id, new.payer_name, new.payer_email, new.description, new.mp_payment_id);
+        END
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS {schema}.payments_fts_ad AFTER DELETE ON payments BEGIN
+            INSERT INTO payments_fts (payments_fts, rowid, payer_name, payer_email, description, mp_payment_id)
+            VALUES ('delete', old.id, old.payer_name, old.payer_email, old.description, old.mp_payment_id);
+        END
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS {schema}.payments_fts_au AFTER UPDATE ON payments BEGIN
+            INSERT INTO payments_fts (payments_fts, rowid, payer_name, payer_email, description, mp_payment_id)
+            VALUES ('delete', old.id, old.payer_name, old.payer_email, old.description, old.mp_payment_id);
+            INSERT INTO payments_fts (rowid, payer_name, payer_email, description, mp_payment_id)
+            VALUES (new.id, new.payer_name, new.payer_email, new.description, new.mp_payment_id);
+        END
+    """,
+]
+
+_ANIO_RE = re.compile(r"\d{4}")
+
+
+def get_connection():
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+@lru_cache(maxsize=None)
+def payment_record(columns):
+    """Tipo Payment (tupla con nombres) para una proyeccion de columnas.
+
+    Mas liviano que un dict por fila y se accede igual por atributo (p.amount),
+    tambien desde los templates.
+    """
+    return namedtuple("Payment", columns)
+
+
+def _fetch_records(conn, columns, query, params):
+    record = payment_record(columns)
+    conn.row_factory = None
+    return [record._make(row) for row in conn.execute(query, params)]
+
+
+# --- Particiones: payments.db guarda el año en curso, cada año cerrado vive en archivo/payments_AAAA.db ---
+
+def _archive_path(anio):
+    return os.path.join(ARCHIVE_DIR, f"payments_{anio}.db")
+
+
+def archived_years():
+    """Devuelve los años que ya tienen archivo propio, del mas nuevo al mas viejo."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    anios = []
+    for name in os.listdir(ARCHIVE_DIR):
+        match = re.fullmatch(r"payments_(\d{4})\.db", name)
+        if match:
+            anios.append(match.group(1))
+    return sorted(anios, reverse=True)
+
+
+def _attach_years(conn, anios):
+    """Adjunta los archivos de los años pedidos y devuelve las tablas a consultar."""
+    tablas = ["main.payments"]
+    for anio in sorted(set(anios), reverse=True):
+        if not anio or not _ANIO_RE.fullmatch(anio) or not os.path.exists(_archive_path(anio)):
+            continue
+        alias = f"anio_{anio}"
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (_archive_path(anio),))
+        tablas.append(f"{alias}.payments")
+    return tablas
+
+
+def _payments_source(tablas):
+    """Arma la fuente FROM: la tabla caliente sola o un UNION ALL con los años adjuntos."""
+    if len(tablas) == 1:
+        return "payments"
+    cols = ", ".join(COLUMNS)
+    union = " UNION ALL ".join(f"SELECT {cols} FROM {t}" for t in tablas)
+    return f"({union}) AS payments"
+
+
+def _ensure_search_index(conn, schema):
+    """Crea el indice de busqueda y sus triggers. False si este SQLite no trae FTS5."""
+    exists = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'payments_fts'"
+    ).fetchone()
+    try:
+        for statement in SEARCH_SCHEMA:
+            conn.execute(statement.format(schema=schema))
+    except sqlite3.OperationalError as e:
+        print(f"[DB] Busqueda sin FTS5 (se usa LIKE): {e}")
+        return False
+    if not exists:
+        # Tabla nueva sobre datos existentes: indexar lo que ya habia
+        conn.execute(f"INSERT INTO {schema}.payments_fts (payments_fts) VALUES ('rebuild')")
+    return True
+
+
+def _has_search_index(conn):
+    return conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'payments_fts'").fetchone() is not None
+
+
+def connect_years(anios):
+    """Abre una conexion con los archivos de esos años adjuntos. Devuelve (conn, fuente FROM)."""
+    conn = get_connection()
+    return conn, _payments_source(_attach_years(conn, anios))
+
+
+# COUNT(*) por archivo anual y filtro. Un año cerrado solo cambia en el rollover
+# (que cambia el mtime), asi que el polling del dashboard no reabre los archivos.
+_archive_counts = {}
+
+
+def _archive_count(path, where, params):
+    key = (path, os.stat(path).st_mtime_ns, where, tuple(params))
+    count = _archive_counts.get(key)
+    if count is None:
+        if len(_archive_counts) > 256:
+            _archive_counts.clear()
+        conn = sqlite3.connect(path)
+        try:
+            count = conn.execute(f"SELECT COUNT(*) FROM payments{where}", params).fetchone()[0]
+        finally:
+            conn.close()
+        _archive_counts[key] = count
+    return count
+
+
+def _archive_rows(path, query, params):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _years_between(date_from, date_to):
+    """Años archivados que toca un rango de fechas (cualquiera de los extremos puede faltar)."""
+    desde = (date_from or "")[:4]
+    hasta = (date_to or "")[:4]
+    return [
+        anio for anio in archived_years()
+        if (not desde or anio >= desde) and (not hasta or anio <= hasta)
+    ]
+
+
+def init_db():
+    conn = get_connection()
+    conn.execute(PAYMENTS_SCHEMA.format(schema="main"))
     # Agregar columnas si la tabla ya existia sin ellas
     for col, col_type in [("payment_type", "TEXT"), ("bank", "TEXT")]:
         try:
             conn.execute(f"ALTER TABLE payments ADD COLUMN {col} {col_type}")
         except sqlite3.OperationalError:
             pass
+    conn.execute(PAYMENTS_INDEX.format(schema="main"))
+    _ensure_search_index(conn, "main")
+    # Cache de estadisticas de periodos cerrados (ver analytics.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stats_cache (
+            periodo TEXT,
+            valor TEXT,
+            data TEXT,
+            PRIMARY KEY (periodo, valor)
+        )
+    """)
     conn.commit()
+    # Archivos creados antes de que existieran los indices
+    for anio in archived_years():
+        conn.execute("ATTACH DATABASE ? AS archivo", (_archive_path(anio),))
+        conn.execute(PAYMENTS_INDEX.format(schema="archivo"))
+        _ensure_search_index(conn, "archivo")
+        conn.commit()
+        conn.execute("DETACH DATABASE archivo")
     conn.close()
 
 
 def insert_payment(data):
+    return bool(insert_payments_bulk([data]))
+
+
+def insert_payments_bulk(payments):
+    """Inserta varios pagos en una sola transaccion.
+
+    Devuelve los mp_payment_id que no existian todavia (en la tabla caliente
+    ni en el archivo de su año), en el orden recibido.
+    """
+    rows = {}
+    for data in payments:
+        rows.setdefault(str(data["mp_payment_id"]), data)
+    if not rows:
+        return []
+
     conn = get_connection()
     try:
-        conn.execute("""
-            INSERT OR IGNORE INTO payments
+        # ATTACH no se puede dentro de una transaccion: adjuntar antes del BEGIN
+        tablas = _attach_years(conn, [(data.get("date_created") or "")[:4] for data in rows.values()])
+        conn.execute("BEGIN IMMEDIATE")
+
+        existing = set()
+        ids = list(rows)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            for tabla in tablas:
+                existing.update(
+                    row[0] for row in conn.execute(
+                        f"SELECT mp_payment_id FROM {tabla} WHERE mp_payment_id IN ({marks})", chunk
+                    )
+                )
+
+        new_ids = [pid for pid in ids if pid not in existing]
+        conn.executemany("""
+            INSERT OR IGNORE INTO main.payments
             (mp_payment_id, payer_name, payer_email, amount, description, status, payment_type, bank, date_created)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            str(data["mp_payment_id"]),
-            data.get("payer_name", "Desconocido"),
-            data.get("payer_email", ""),
-            data.get("amount", 0),
-            data.get("description", ""),
-            data.get("status", ""),
-            data.get("payment_type", ""),
-            data.get("bank", ""),
-            data.get("date_created", ""),
-        ))
+        """, [
+            (
+                pid,
+                rows[pid].get("payer_name", "Desconocido"),
+                rows[pid].get("payer_email", ""),
+                rows[pid].get("amount", 0),
+                rows[pid].get("description", ""),
+                rows[pid].get("status", ""),
+                rows[pid].get("payment_type", ""),
+                rows[pid].get("bank", ""),
+                rows[pid].get("date_created", ""),
+            )
+            for pid in new_ids
+        ])
+        # Invalidar las estadisticas cacheadas de los periodos que recibieron pagos nuevos
+        claves = set()
+        for pid in new_ids:
+            fecha = rows[pid].get("date_created") or ""
+            claves.update([("dia", fecha[:10]), ("mes", fecha[:7]), ("anio", fecha[:4])])
+        conn.executemany("DELETE FROM main.stats_cache WHERE periodo = ? AND valor = ?", claves)
         conn.commit()
-        inserted = conn.total_changes > 0
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
-    return inserted
+    return new_ids
 
 
 def get_totals(dia=None, mes=None, anio=None):
     """Devuelve totales de pagos aprobados para dia, mes y año indicados."""
     conn = get_connection()
     params = []
+    anio_actual = datetime.now().strftime("%Y")
+    tablas = _attach_years(conn, [(dia or anio_actual)[:4], (mes or anio_actual)[:4], anio or anio_actual])
 
     # Dia: comparar los primeros 10 caracteres (YYYY-MM-DD)
     if dia:
@@ -91,7 +331,7 @@ def get_totals(dia=None, mes=None, anio=None):
             COALESCE(SUM(CASE WHEN {dia_cond} THEN amount END), 0) AS total_dia,
             COALESCE(SUM(CASE WHEN {mes_cond} THEN amount END), 0) AS total_mes,
             COALESCE(SUM(CASE WHEN {anio_cond} THEN amount END), 0) AS total_anio
-        FROM payments
+        FROM {_payments_source(tablas)}
         WHERE status = 'approved'
     """, params).fetchone()
     conn.close()
@@ -102,48 +342,142 @@ def get_totals(dia=None, mes=None, anio=None):
     }
 
 
-def get_payments_by_period(periodo, valor):
-    """Devuelve pagos aprobados para un periodo (dia/mes/anio)."""
+def get_payments_by_period(periodo, valor, columns=COLUMNS):
+    """Devuelve pagos aprobados para un periodo (dia/mes/anio) como registros Payment."""
     conn = get_connection()
+    source = _payments_source(_attach_years(conn, [valor[:4]]))
+    cols = ", ".join(columns)
     if periodo == "dia":
-        query = "SELECT * FROM payments WHERE status = 'approved' AND substr(date_created, 1, 10) = ? ORDER BY date_created DESC"
+        query = f"SELECT {cols} FROM {source} WHERE status = 'approved' AND substr(date_created, 1, 10) = ? ORDER BY date_created DESC"
         params = [valor]
     elif periodo == "mes":
-        query = "SELECT * FROM payments WHERE status = 'approved' AND substr(date_created, 1, 7) = ? ORDER BY date_created DESC"
+        query = f"SELECT {cols} FROM {source} WHERE status = 'approved' AND substr(date_created, 1, 7) = ? ORDER BY date_created DESC"
         params = [valor]
     else:
-        query = "SELECT * FROM payments WHERE status = 'approved' AND substr(date_created, 1, 4) = ? ORDER BY date_created DESC"
+        query = f"SELECT {cols} FROM {source} WHERE status = 'approved' AND substr(date_created, 1, 4) = ? ORDER BY date_created DESC"
         params = [valor]
-    rows = conn.execute(query, params).fetchall()
+    payments = _fetch_records(conn, columns, query, params)
     conn.close()
-    return [dict(row) for row in rows]
+    return payments
+
 
+def get_payments(date_from=None, date_to=None, amount_min=None, amount_max=None, page=1, per_page=15, search=None,
+                 columns=COLUMNS):
+    """Pagina de pagos, del mas nuevo al mas viejo, como registros Payment.
 
-def get_payments(date_from=None, date_to=None, amount_min=None, amount_max=None, page=1, per_page=15):
+    Cada archivo anual se consulta por separado (sin ATTACH, que tiene un
+    limite de 10 bases) y solo si la pagina pedida llega hasta ese año.
+    """
     where = " WHERE 1=1"
     params = []
-
-    if date_from:
-        where += " AND date_created >= ?"
-        params.append(date_from)
-    if date_to:
-        where += " AND date_created <= ?"
-        params.append(date_to + " 23:59:59")
-    if amount_min:
-        where += " AND amount >= ?"
-        params.append(float(amount_min))
-    if amount_max:
-        where += " AND amount <= ?"
-        params.append(float(amount_max))
+    offset = (page - 1) * per_page
+    needed = offset + per_page
 
     conn = get_connection()
+    try:
+        # Busqueda por nombre, email, descripcion o ID: cada palabra como prefijo, todas obligatorias
+        terms = re.findall(r"\w+", search or "")
+        if terms and _has_search_index(conn):
+            where += " AND id IN (SELECT rowid FROM payments_fts WHERE payments_fts MATCH ?)"
+            params.append(" ".join(f'"{term}"*' for term in terms))
+        else:
+            for term in terms:
+                where += " AND (payer_name LIKE ? OR payer_email LIKE ? OR description LIKE ? OR mp_payment_id LIKE ?)"
+                params.extend([f"%{term}%"] * 4)
 
-    total = conn.execute(f"SELECT COUNT(*) FROM payments{where}", params).fetchone()[0]
+        if date_from:
+            where += " AND date_created >= ?"
+            params.append(date_from)
+        if date_to:
+            where += " AND date_created <= ?"
+            params.append(date_to + " 23:59:59")
+        if amount_min:
+            where += " AND amount >= ?"
+            params.append(float(amount_min))
+        if amount_max:
+            where += " AND amount <= ?"
+            params.append(float(amount_max))
 
-    query = f"SELECT * FROM payments{where} ORDER BY date_created DESC LIMIT ? OFFSET ?"
-    params.extend([per_page, (page - 1) * per_page])
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
+        total = conn.execute(f"SELECT COUNT(*) FROM payments{where}", params).fetchone()[0]
+
+        # date_created va primero para poder mezclar las particiones en orden
+        query = f"SELECT date_created, {', '.join(columns)} FROM payments{where} ORDER BY date_created DESC LIMIT ?"
+        conn.row_factory = None
+        partes = [conn.execute(query, params + [needed]).fetchall()]
+    finally:
+        conn.close()
+
+    # Los archivos no se solapan entre si. Delante de un año quedan los archivos
+    # mas nuevos y las filas calientes posteriores a ese año: si entre ambos ya
+    # cubren la pagina, el archivo no se abre.
+    archivados = 0
+    for anio in _years_between(date_from, date_to):
+        path = _archive_path(anio)
+        count = _archive_count(path, where, params)
+        siguiente = str(int(anio) + 1)
+        delante = archivados + sum(1 for row in partes[0] if (row[0] or "") >= siguiente)
+        if count and delante < needed:
+            partes.append(_archive_rows(path, query, params + [needed - delante]))
+        archivados += count
+        total += count
+
+    record = payment_record(columns)
+    rows = heapq.merge(*partes, key=lambda row: row[0] or "", reverse=True)
+    payments = [record._make(row[1:]) for row in islice(rows, offset, needed)]
 
     total_pages = max(1, (total + per_page - 1) // per_page)
-    return [dict(row) for row in rows], total, total_pages
+    return payments, total, total_pages
+
+
+def rollover_payments():
+    """Mueve los pagos de años cerrados a su archivo anual y compacta la base caliente.
+
+    Devuelve la cantidad de pagos movidos.
+    """
+    anio_actual = datetime.now().strftime("%Y")
+    conn = get_connection()
+    movidos = 0
+    try:
+        anios = [
+            row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(date_created, 1, 4) FROM payments WHERE substr(date_created, 1, 4) < ?",
+                (anio_actual,),
+            )
+        ]
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        # Sin id: cada archivo asigna el suyo (el rowid del FTS tambien es por archivo)
+        cols = ", ".join(c for c in COLUMNS if c != "id")
+        for anio in anios:
+            if not anio or not _ANIO_RE.fullmatch(anio):
+                continue
+            conn.execute("ATTACH DATABASE ? AS archivo", (_archive_path(anio),))
+            try:
+                conn.execute(PAYMENTS_SCHEMA.format(schema="archivo"))
+                conn.execute(PAYMENTS_INDEX.format(schema="archivo"))
+                _ensure_search_index(conn, "archivo")
+                # Copia y borrado en la misma transaccion: el commit es atomico entre ambos archivos
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO archivo.payments ({cols})
+                    SELECT {cols} FROM main.payments WHERE substr(date_created, 1, 4) = ?
+                """, (anio,))
+                # Borrar solo lo que quedo confirmado en el archivo
+                cur = conn.execute("""
+                    DELETE FROM main.payments
+                    WHERE substr(date_created, 1, 4) = ?
+                    AND mp_payment_id IN (SELECT mp_payment_id FROM archivo.payments)
+                """, (anio,))
+                movidos += cur.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                conn.execute("DETACH DATABASE archivo")
+                raise
+            else:
+                # El año ya esta cerrado, se compacta una vez y queda de solo lectura en la practica
+                conn.execute("VACUUM archivo")
+                conn.execute("DETACH DATABASE archivo")
+        if movidos:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return movidos
@@ -3,8 +3,6 @@ import queue
 import tempfile
 import threading
 
-import edge_tts
-
 # Cola de mensajes y worker unico para evitar conflictos entre hilos
 _message_queue = queue.Queue()
 _worker_started = False
@@ -16,6 +14,9 @@ VOICE = "es-AR-ElenaNeural"
 
 def _tts_worker():
     """Worker que consume la cola y reproduce mensajes uno por uno."""
+    # Import diferido: edge_tts se carga en este hilo, no al importar el modulo
+    import edge_tts
+
     loop = asyncio.new_event_loop()
 
     while True:
@@ -68,6 +69,11 @@ def _ensure_worker():
         _worker_started = True
 
 
+def prewarm_tts():
+    """Arranca el worker antes del primer anuncio para que edge_tts ya este cargado."""
+    _ensure_worker()
+
+
 def announce_payment(name, amount, rejected=False):
     """Encola un anuncio de pago. Se reproducen en orden, uno a la vez."""
     if amount == int(amount):
@@ -0,0 +1,90 @@
+"""Verifica el archivo anual sobre una base temporal (no toca payments.db).
+
+Uso:
+    python verificar_particiones.py
+
+Cubre el rollover (copia y borrado) y el paginado de get_payments mezclando
+la tabla caliente con los archivos, comparado contra un orden hecho en Python.
+"""
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import datetime
+
+import database
+
+
+def _payment(pid, fecha, nombre="Juan Perez", monto=100):
+    return {"mp_payment_id": pid, "payer_name": nombre, "amount": monto, "status": "approved", "date_created": fecha}
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    database.DATABASE_PATH = os.path.join(tmp, "payments.db")
+    database.ARCHIVE_DIR = os.path.join(tmp, "archivo")
+    database.init_db()
+
+    anio = int(datetime.now().strftime("%Y"))
+    random.seed(1)
+    pagos = []
+    for i in range(3000):
+        fecha = f"{random.randint(anio - 4, anio)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}T{i % 24:02d}:00:{i % 60:02d}"
+        pagos.append(_payment(str(i), fecha, random.choice(["José Pérez", "Ana Núñez"]), i % 50))
+    database.insert_payments_bulk(pagos)
+
+    movidos = database.rollover_payments()
+    esperado = sum(1 for p in pagos if p["date_created"][:4] < str(anio))
+    assert movidos == esperado, (movidos, esperado)
+    assert len(database.archived_years()) == 4
+
+    # Pago tardio de un año cerrado que queda en la tabla caliente hasta el proximo rollover
+    tardio = _payment("tardio", f"{anio - 2}-06-01T00:00:00")
+    database.insert_payments_bulk([tardio])
+    pagos.append(tardio)
+
+    ordenados = sorted(pagos, key=lambda p: p["date_created"], reverse=True)
+    paginas = (len(ordenados) + 14) // 15
+    for page in (1, 2, paginas // 2, paginas):
+        payments, total, total_pages = database.get_payments(page=page)
+        assert total == len(ordenados) and total_pages == paginas
+        assert [p.date_created for p in payments] == [p["date_created"] for p in ordenados[(page - 1) * 15:page * 15]], page
+
+    # Busqueda + filtros cruzando archivos
+    desde, hasta = f"{anio - 3}-01-01", f"{anio - 1}-12-31"
+    payments, total, _ = database.get_payments(search="nunez", amount_min="10", date_from=desde, date_to=hasta)
+    filtrados = [
+        p for p in ordenados
+        if p["payer_name"] == "Ana Núñez" and p["amount"] >= 10 and desde <= p["date_created"] <= hasta + " 23:59:59"
+    ]
+    assert total == len(filtrados)
+    assert [p.date_created for p in payments] == [p["date_created"] for p in filtrados[:15]]
+
+    # Si la tabla caliente llena la pagina, no se abre ningun archivo
+    abiertos = []
+    original = database._archive_rows
+    database._archive_rows = lambda path, query, params: abiertos.append(path) or original(path, query, params)
+    try:
+        database.get_payments(page=1)
+    finally:
+        database._archive_rows = original
+    assert not abiertos, abiertos
+
+    # Rollover con la base caliente recreada: el id nuevo choca con uno ya archivado
+    os.remove(database.DATABASE_PATH)
+    database.init_db()
+    database.insert_payments_bulk([_payment("tardio-2", f"{anio - 1}-03-01T00:00:00")])
+    assert database.rollover_payments() == 1
+    conn = sqlite3.connect(os.path.join(database.ARCHIVE_DIR, f"payments_{anio - 1}.db"))
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM payments WHERE mp_payment_id = 'tardio-2'").fetchone()[0] == 1
+    finally:
+        conn.close()
+    payments, _, _ = database.get_payments(search="tardio")
+    assert [p.mp_payment_id for p in payments] == ["tardio-2"]
+
+    print("OK - particiones verificadas")
+
+
+if __name__ == "__main__":
+    main()